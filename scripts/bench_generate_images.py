@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for generate_all_images.py against a local mock Gemini server.
+No API key or quota needed: the mock serves generateContent responses with
+configurable latency, payload size, 429/5xx injection and connection resets.
+
+Each concurrency level runs in its own subprocess so peak RSS is per scenario.
+
+Examples:
+    python scripts/bench_generate_images.py
+    python scripts/bench_generate_images.py --concurrency 1,4,16 --payload-mb 12 --latency lognormal:0.5,0.4
+    python scripts/bench_generate_images.py --rate-429 0.1 --rate-5xx 0.05 --rate-reset 0.02 --output bench.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import base64
+import random
+import socket
+import struct
+import asyncio
+import argparse
+import resource
+import tempfile
+import threading
+import contextlib
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import generate_all_images as gen
+
+# 3840x2160 RGB PNGs from the API come out around 8-16MB
+DEFAULT_PAYLOAD_MB = 1.5
+WRITE_CHUNK_SIZE = 256 * 1024
+
+
+# ============================================================
+# MOCK GEMINI SERVER
+# ============================================================
+
+def parse_latency(spec):
+    """Parse a latency distribution spec into a zero-argument sampler (seconds).
+
+    fixed:0.5 | uniform:0.2,1.5 | lognormal:MEDIAN,SIGMA
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    raise ValueError(f"Invalid latency spec: {spec!r}")
+
+
+def build_response_body(payload_bytes):
+    """A generateContent response carrying `payload_bytes` of image data as base64."""
+    # Only the PNG signature is real; the benchmark never runs the optimizer on it
+    data = gen.PNG_SIGNATURE + os.urandom(max(0, payload_bytes - len(gen.PNG_SIGNATURE)))
+    return json.dumps({
+        "candidates": [{
+            "content": {"parts": [
+                {"text": "Here is your image."},
+                {"inlineData": {"mimeType": "image/png", "data": base64.b64encode(data).decode("ascii")}},
+            ]},
+            "finishReason": "STOP",
+        }],
+    }).encode("utf-8")
+
+
+class MockGeminiServer:
+    """Threaded keep-alive HTTP stub of the generateContent endpoint."""
+
+    def __init__(self, latency="fixed:0.2", payload_bytes=int(DEFAULT_PAYLOAD_MB * 1e6),
+                 rate_429=0.0, rate_5xx=0.0, rate_reset=0.0, retry_after=1.0, seed=None):
+        self.sample_latency = parse_latency(latency)
+        self.body = build_response_body(payload_bytes)
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rate_reset = rate_reset
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.counts = {"requests": 0, "ok": 0, "429": 0, "5xx": 0, "reset": 0}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._httpd.server_port}"
+
+    def _roll(self):
+        with self._lock:
+            self.counts["requests"] += 1
+            roll = self.random.random()
+            if roll < self.rate_429:
+                outcome = "429"
+            elif roll < self.rate_429 + self.rate_5xx:
+                outcome = "5xx"
+            elif roll < self.rate_429 + self.rate_5xx + self.rate_reset:
+                outcome = "reset"
+            else:
+                outcome = "ok"
+            self.counts[outcome] += 1
+            return outcome, self.sample_latency()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, headers=()):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                view = memoryview(body)
+                for offset in range(0, len(body), WRITE_CHUNK_SIZE):
+                    self.wfile.write(view[offset:offset + WRITE_CHUNK_SIZE])
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                outcome, latency = server._roll()
+                time.sleep(latency)
+                if outcome == "429":
+                    body = b'{"error": {"code": 429, "message": "Resource has been exhausted"}}'
+                    self._send(429, body, [("Retry-After", f"{server.retry_after:g}")])
+                elif outcome == "5xx":
+                    self._send(503, b'{"error": {"code": 503, "message": "The model is overloaded"}}')
+                elif outcome == "reset":
+                    # Headers and part of the body, then drop the connection
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(server.body)))
+                    self.end_headers()
+                    self.wfile.write(server.body[:len(server.body) // 3])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    # SO_LINGER with a zero timeout makes close() send an RST
+                    self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                    self.connection.close()
+                else:
+                    self._send(200, server.body)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+# ============================================================
+# SCENARIOS
+# ============================================================
+
+def benchmark_images(repeat):
+    """The catalog batch, repeated `repeat` times under unique filenames."""
+    images = gen.load_images()
+    if repeat <= 1:
+        return images
+    batch = []
+    for i in range(repeat):
+        for image_def in images:
+            copy = dict(image_def)
+            copy["filename"] = f"{os.path.splitext(image_def['filename'])[0]}-{i}.jpg"
+            batch.append(copy)
+    return batch
+
+
+def run_scenario(base_url, concurrency, adaptive, repeat, max_attempts, backoff_base):
+    """Run one batch against `base_url` in this process and return its measurements."""
+    output_dir = tempfile.mkdtemp(prefix="bench-images-")
+    gen.API_BASE = base_url
+    gen.API_KEY = "bench"
+    gen.OUTPUT_DIR = output_dir
+    gen.CACHE_MANIFEST = os.path.join(output_dir, ".generation-manifest.json")
+
+    images = benchmark_images(repeat)
+    engine = gen.GenerationEngine(
+        {},
+        concurrency=concurrency,
+        max_concurrency=concurrency * 4 if adaptive else concurrency,
+        rate=1e6,
+        burst=concurrency * 4,
+        max_attempts=max_attempts,
+        force=True,
+        backoff_base=backoff_base,
+    )
+
+    started = time.monotonic()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = asyncio.run(engine.run(images))
+    wall_seconds = time.monotonic() - started
+
+    metrics = [engine.metrics[filename] for filename, _, _ in results]
+    summary = gen.summarize_metrics(metrics, wall_seconds)
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    summary["peakRssMB"] = round(peak_rss / (1e6 if sys.platform == "darwin" else 1e3), 1)
+    summary["concurrency"] = concurrency
+    summary["adaptive"] = adaptive
+    summary["finalLimit"] = round(sum(shard.limiter.limit for shard in engine.scheduler.shards), 2)
+    summary["connectionsOpened"] = sum(p.connections_opened for p in engine.client._pools.values())
+
+    for name in os.listdir(output_dir):
+        os.unlink(os.path.join(output_dir, name))
+    os.rmdir(output_dir)
+    return summary
+
+
+def run_scenario_subprocess(base_url, concurrency, args):
+    """Run one scenario in a fresh interpreter so ru_maxrss only covers that scenario."""
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", base_url,
+           "--concurrency", str(concurrency), "--repeat", str(args.repeat),
+           "--max-attempts", str(args.max_attempts), "--backoff-base", str(args.backoff_base)]
+    if args.adaptive:
+        cmd.append("--adaptive")
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def print_table(rows):
+    columns = [
+        ("concurrency", "conc"), ("generated", "ok"), ("failed", "fail"), ("attempts", "tries"),
+        ("imagesPerMinute", "img/min"), ("megabytesPerSecond", "MB/s"), ("latencyP50", "p50 s"),
+        ("latencyP95", "p95 s"), ("latencyP99", "p99 s"), ("totalSecondsP99", "p99 e2e"),
+        ("peakRssMB", "RSS MB"), ("connectionsOpened", "conns"),
+    ]
+    print("  " + " ".join(f"{title:>9}" for _, title in columns))
+    for row in rows:
+        print("  " + " ".join(f"{str(row.get(key)):>9}" for key, _ in columns))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the image generation pipeline against a mock Gemini server.")
+    parser.add_argument("--concurrency", default="1,3,8,16",
+                        help="comma-separated concurrency levels to benchmark (default: 1,3,8,16)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="let AIMD grow each level up to 4x instead of pinning it")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="run the catalog batch N times per scenario (default: 1)")
+    parser.add_argument("--latency", default="lognormal:0.3,0.5",
+                        help="server latency: fixed:S | uniform:LO,HI | lognormal:MEDIAN,SIGMA (default: %(default)s)")
+    parser.add_argument("--payload-mb", type=float, default=DEFAULT_PAYLOAD_MB,
+                        help="decoded image size per response in MB (4K PNG: ~12) (default: %(default)s)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--rate-reset", type=float, default=0.0, help="fraction of responses cut off mid-body")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--max-attempts", type=int, default=5, help="attempts per image (default: 5)")
+    parser.add_argument("--backoff-base", type=float, default=0.2,
+                        help="engine backoff base in seconds (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=None, help="seed for fault injection")
+    parser.add_argument("--output", help="write all scenario results to this JSON file")
+    parser.add_argument("--worker", metavar="BASE_URL", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.worker:
+        summary = run_scenario(args.worker, int(args.concurrency), args.adaptive, args.repeat,
+                               args.max_attempts, args.backoff_base)
+        print(json.dumps(summary))
+        return 0
+
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+    server = MockGeminiServer(
+        latency=args.latency,
+        payload_bytes=int(args.payload_mb * 1e6),
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        rate_reset=args.rate_reset,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    ).start()
+
+    print(f"\n{'='*60}")
+    print(f"  Image Generation Benchmark (mock server {server.base_url})")
+    print(f"  Latency: {args.latency}, payload: {args.payload_mb}MB, "
+          f"faults: 429={args.rate_429} 5xx={args.rate_5xx} reset={args.rate_reset}")
+    print(f"  Concurrency levels: {levels}{' (adaptive)' if args.adaptive else ''}")
+    print(f"{'='*60}\n")
+
+    rows = []
+    try:
+        for level in levels:
+            rows.append(run_scenario_subprocess(server.base_url, level, args))
+            print(f"  concurrency {level}: {rows[-1]['imagesPerMinute']} images/min, "
+                  f"p99 {rows[-1]['latencyP99']}s, peak RSS {rows[-1]['peakRssMB']}MB")
+    finally:
+        server.stop()
+
+    print()
+    print_table(rows)
+    print(f"\n  Server: {server.counts}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "server": server.counts, "scenarios": rows}, f, indent=2)
+            f.write("\n")
+        print(f"  Results: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,25 +2,57 @@
 """
 Generate all landing page and studio images using Nano Banana Pro (Gemini API).
 Uses detailed prompts from STYLE_PROMPTS library for accurate, high-quality 4K images.
-Runs concurrent requests for speed.
+Runs requests on an asyncio engine that adapts concurrency to the API's rate limits,
+optionally sharded across several API keys (GEMINI_API_KEYS) and models (--model).
+
+Each output's prompt/model/config hash is recorded in a manifest next to the images,
+so only images whose inputs changed are regenerated on later runs.
+
+Image definitions live in scripts/landing-images.json. Examples:
+    python scripts/generate_all_images.py --list
+    python scripts/generate_all_images.py 'style-*' --dry-run
+    python scripts/generate_all_images.py --tag studio
+    python scripts/generate_all_images.py --matrix --tag matrix --dry-run
 """
 
 import os
 import sys
 import json
-import base64
+import binascii
+import tempfile
+import shutil
 import time
-import urllib.request
-import urllib.error
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import random
+import asyncio
+import hashlib
+import argparse
+import csv
+import dataclasses
+import fnmatch
+import string
+import uuid
+import re
+import threading
+import email.utils
+import contextlib
+import http.client
+import urllib.parse
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
+# Only required for runs that call the API; --list and --dry-run work without it
 API_KEY = os.environ.get("GEMINI_API_KEY", "")
-if not API_KEY:
-    print("ERROR: Set GEMINI_API_KEY environment variable")
-    sys.exit(1)
+# Optional comma-separated pool of keys; the batch is sharded across all of them
+API_KEYS = [key.strip() for key in os.environ.get("GEMINI_API_KEYS", "").split(",") if key.strip()]
 MODEL = "gemini-2.0-flash-exp-image-generation"
-API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL}:generateContent?key={API_KEY}"
+# Override to point the script at a local stub server
+API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "landing-images.json")
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "public", "images", "landing")
+GENERATION_CONFIG = {"responseModalities": ["IMAGE", "TEXT"]}
+
+# Manifest recording which prompt/model/config produced each output file
+CACHE_MANIFEST = os.path.join(OUTPUT_DIR, ".generation-manifest.json")
 
 # Base quality instructions for ALL prompts
 QUALITY_PREFIX = "Generate a photorealistic, ultra high resolution 4K image. Professional architectural photography with perfect composition, natural lighting, and stunning detail. Magazine-worthy quality for Architectural Digest."
@@ -61,254 +93,1714 @@ ROOM_DETAILS = {
 }
 
 # ============================================================
-# IMAGE DEFINITIONS - All images needed for the site
+# IMAGE CATALOG - declarative definitions in landing-images.json
+# ============================================================
+
+# Placeholders a catalog template may use
+TEMPLATE_FIELDS = {"quality", "style", "room", "style_name", "room_name"}
+# Hand-written images are scheduled ahead of matrix cells unless they say otherwise
+DEFAULT_PRIORITY = 100
+
+
+def slugify(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+def expand_matrix(matrix):
+    """Expand a catalog matrix into one definition per style x room cell.
+
+    "styles"/"rooms" are key lists or "*" for every STYLE_PROMPTS/ROOM_DETAILS
+    key; a cell's priority is the sum of its style and room weights.
+    """
+    styles = list(STYLE_PROMPTS) if matrix.get("styles", "*") == "*" else matrix["styles"]
+    rooms = list(ROOM_DETAILS) if matrix.get("rooms", "*") == "*" else matrix["rooms"]
+    weights = matrix.get("priority", {})
+    tags = sorted({matrix["id"], *matrix.get("tags", ())})
+    for style in styles:
+        for room in rooms:
+            yield {
+                "filename": f"{matrix.get('prefix', matrix['id'])}-{style}-{slugify(room)}.jpg",
+                "style": style,
+                "room": room,
+                "template": matrix["template"],
+                "group": matrix["id"],
+                "tags": tags,
+                "priority": weights.get("styles", {}).get(style, 0) + weights.get("rooms", {}).get(room, 0),
+            }
+
+
+def load_images(path=CATALOG_PATH, include_matrices=False):
+    """Load the image catalog as a flat list of unrendered image definitions.
+
+    Each definition carries its group id, tags and priority; prompts are
+    rendered on demand by render_prompt(). Matrix cells are only expanded when
+    `include_matrices` is set.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        catalog = json.load(f)
+    images = []
+    for group in catalog["groups"]:
+        for entry in group["images"]:
+            image_def = dict(entry)
+            image_def["group"] = group["id"]
+            image_def["tags"] = sorted({group["id"], *group.get("tags", ()), *entry.get("tags", ())})
+            image_def.setdefault("priority", group.get("priority", DEFAULT_PRIORITY))
+            images.append(image_def)
+    if include_matrices:
+        for matrix in catalog.get("matrices", ()):
+            images.extend(expand_matrix(matrix))
+    return images
+
+
+def validate_images(images):
+    """Return a list of problems with the catalog (empty if it is valid)."""
+    errors = []
+    seen = set()
+    for image_def in images:
+        filename = image_def.get("filename", "<missing filename>")
+        if filename in seen:
+            errors.append(f"{filename}: duplicate filename")
+        seen.add(filename)
+        fields = {name for _, name, _, _ in string.Formatter().parse(image_def.get("template", "")) if name}
+        for name in sorted(fields - TEMPLATE_FIELDS):
+            errors.append(f"{filename}: unknown placeholder {{{name}}}")
+        if fields & {"style", "style_name"} and image_def.get("style") not in STYLE_PROMPTS:
+            errors.append(f"{filename}: unknown style {image_def.get('style')!r}")
+        if fields & {"room", "room_name"} and image_def.get("room") not in ROOM_DETAILS:
+            errors.append(f"{filename}: unknown room {image_def.get('room')!r}")
+    return errors
+
+
+_fragment_index = None
+
+
+def prompt_fragments():
+    """Interned text for every template field, built once per process.
+
+    Keys are (field, style-or-room key). Matrix cells share these strings
+    instead of each holding its own copy of the style and room text.
+    """
+    global _fragment_index
+    if _fragment_index is None:
+        index = {("quality", None): QUALITY_PREFIX}
+        for key, text in STYLE_PROMPTS.items():
+            index[("style", key)] = text
+            index[("style_name", key)] = key.replace("-", " ")
+        for key, text in ROOM_DETAILS.items():
+            index[("room", key)] = text
+            index[("room_name", key)] = key.lower()
+        _fragment_index = {field: sys.intern(text) for field, text in index.items()}
+    return _fragment_index
+
+
+def render_prompt(image_def):
+    """Render (and memoize) the full prompt for one image definition.
+
+    Rendered prompts are interned, so identical prompts are the same object.
+    """
+    if "prompt" not in image_def:
+        fragments = prompt_fragments()
+        style, room = image_def.get("style"), image_def.get("room")
+        image_def["prompt"] = sys.intern(image_def["template"].format(
+            quality=fragments[("quality", None)],
+            style=fragments.get(("style", style), ""),
+            room=fragments.get(("room", room), ""),
+            style_name=fragments.get(("style_name", style), ""),
+            room_name=fragments.get(("room_name", room), ""),
+        ))
+    return image_def["prompt"]
+
+
+def prioritize(images):
+    """Highest priority first; catalog order breaks ties."""
+    return sorted(images, key=lambda image_def: -image_def.get("priority", 0))
+
+
+def group_duplicates(images):
+    """Split definitions into (leaders, followers) by rendered prompt.
+
+    Only the first definition with a given prompt is generated; `followers`
+    maps its filename to the other definitions that receive a copy.
+    """
+    leaders = []
+    followers = {}
+    first_by_prompt = {}
+    for image_def in images:
+        leader = first_by_prompt.setdefault(render_prompt(image_def), image_def)
+        if leader is image_def:
+            leaders.append(image_def)
+        else:
+            followers.setdefault(leader["filename"], []).append(image_def)
+    return leaders, followers
+
+
+def select_images(images, patterns=(), tags=()):
+    """Filter by filename globs and/or tags (group ids count as tags); no filters selects all."""
+    selected = []
+    for image_def in images:
+        if patterns and not any(fnmatch.fnmatch(image_def["filename"], p) for p in patterns):
+            continue
+        if tags and not set(tags) & set(image_def["tags"]):
+            continue
+        selected.append(image_def)
+    return selected
+
+
+# ============================================================
+# OUTPUT CACHE - regenerate only images whose inputs changed
 # ============================================================
 
-IMAGES = [
-    # ---- BEFORE IMAGES (empty rooms) ----
-    {
-        "filename": "before-empty.jpg",
-        "prompt": f"{QUALITY_PREFIX} An empty, unfurnished living room photographed in the style of real estate photography. Bare white walls, light hardwood flooring, large windows letting in natural daylight, no furniture, no decorations. Clean, bright, spacious but empty. The room should look like a blank canvas waiting for design. Wide-angle lens, even lighting."
-    },
-    {
-        "filename": "before-bedroom.jpg",
-        "prompt": f"{QUALITY_PREFIX} An empty, unfurnished bedroom. Bare walls painted soft white, light wood or carpet flooring, one window with natural light streaming in. No furniture, no curtains, no decorations. Empty closet door visible. The room feels blank and uninspired, ready to be transformed. Wide-angle shot."
-    },
-    {
-        "filename": "before-kitchen.jpg",
-        "prompt": f"{QUALITY_PREFIX} An empty, basic kitchen with plain white cabinets, basic countertops, no decorations, no appliances on counters, generic fluorescent lighting. The kitchen looks functional but completely uninspired and lifeless. Beige walls. Wide-angle real estate style photo."
-    },
-    {
-        "filename": "before-study.jpg",
-        "prompt": f"{QUALITY_PREFIX} An empty, unfurnished home office or study room. Bare walls, basic flooring, one window. No desk, no shelves, no furniture. Just an empty room with natural light. Clean but completely bare and uninviting."
-    },
-
-    # ---- HERO IMAGE ----
-    {
-        "filename": "hero-showcase.jpg",
-        "prompt": f"{QUALITY_PREFIX} A breathtaking modern luxury living room that showcases the pinnacle of AI-powered interior design. Floor-to-ceiling windows overlooking a city skyline at golden hour. {STYLE_PROMPTS['modern']}. {ROOM_DETAILS['Living Room']}. The space should look absolutely stunning, like the cover of Architectural Digest. Dramatic natural lighting, perfect composition, ultra high detail on every texture and material."
-    },
-
-    # ---- AFTER/SHOWCASE IMAGES (styled transformations) ----
-    {
-        "filename": "after-modern.jpg",
-        "prompt": f"{QUALITY_PREFIX} A beautifully designed modern minimalist living room. {STYLE_PROMPTS['modern']}. {ROOM_DETAILS['Living Room']}. The room should feel warm, inviting, and magazine-worthy. Natural sunlight streams through large windows. Every detail is perfect - from the texture of fabrics to the grain of wood. Wide-angle architectural photography."
-    },
-    {
-        "filename": "after-scandinavian.jpg",
-        "prompt": f"{QUALITY_PREFIX} A stunning Scandinavian-style bedroom. {STYLE_PROMPTS['scandinavian']}. {ROOM_DETAILS['Bedroom']}. Cozy hygge atmosphere with soft morning light filtering through sheer white curtains. The space feels serene, warm, and perfectly balanced. Professional interior photography."
-    },
-    {
-        "filename": "after-industrial.jpg",
-        "prompt": f"{QUALITY_PREFIX} A dramatic industrial-style loft kitchen. {STYLE_PROMPTS['industrial']}. {ROOM_DETAILS['Kitchen']}. High ceilings with exposed ductwork, warm Edison lighting, and a mix of raw and refined materials. The space feels urban, sophisticated, and full of character. Moody atmospheric lighting."
-    },
-    {
-        "filename": "after-japandi.jpg",
-        "prompt": f"{QUALITY_PREFIX} A serene Japandi-style home office. {STYLE_PROMPTS['japandi']}. {ROOM_DETAILS['Office']}. The space combines Japanese zen with Scandinavian functionality. Natural materials, low profile furniture, muted earth tones. Peaceful, focused, and beautifully minimal. Soft diffused natural light."
-    },
-
-    # ---- STYLE GALLERY - FEATURED (6 large cards) ----
-    {
-        "filename": "style-coastal.jpg",
-        "prompt": f"{QUALITY_PREFIX} A dreamy coastal-style living room. {STYLE_PROMPTS['coastal']}. {ROOM_DETAILS['Living Room']}. Ocean visible through large windows. The room feels like a luxury beach house. Light, airy, and absolutely beautiful. Professional interior photography with warm afternoon light."
-    },
-    {
-        "filename": "style-artdeco.jpg",
-        "prompt": f"{QUALITY_PREFIX} A glamorous Art Deco dining room. {STYLE_PROMPTS['art-deco']}. {ROOM_DETAILS['Dining Room']}. The room exudes 1920s luxury with modern comfort. Geometric patterns, gold accents, rich velvet. Evening lighting with warm glow from crystal chandelier. Gatsby-era opulence."
-    },
-    {
-        "filename": "style-midcentury.jpg",
-        "prompt": f"{QUALITY_PREFIX} A stylish mid-century modern living room. {STYLE_PROMPTS['mid-century']}. {ROOM_DETAILS['Living Room']}. Iconic 1950s-60s furniture pieces, organic shapes, warm wood tones. The space feels retro yet timeless. Warm afternoon light through large windows. Professional design photography."
-    },
-    {
-        "filename": "style-bohemian.jpg",
-        "prompt": f"{QUALITY_PREFIX} A vibrant bohemian-style bedroom. {STYLE_PROMPTS['bohemian']}. {ROOM_DETAILS['Bedroom']}. Rich textures, eclectic patterns, warm jewel tones. Plants cascading from shelves. The room feels free-spirited, warm, and deeply personal. Soft golden light."
-    },
-    {
-        "filename": "style-luxury.jpg",
-        "prompt": f"{QUALITY_PREFIX} An ultra-luxurious master suite. {STYLE_PROMPTS['luxury']}. {ROOM_DETAILS['Bedroom']}. Marble, gold accents, crystal chandelier, velvet headboard. The room looks like a five-star hotel presidential suite. Evening mood lighting with warm glow. Absolute opulence."
-    },
-    {
-        "filename": "style-rustic.jpg",
-        "prompt": f"{QUALITY_PREFIX} A cozy rustic farmhouse kitchen. {STYLE_PROMPTS['rustic']}. {ROOM_DETAILS['Kitchen']}. Reclaimed wood, stone, copper. The kitchen feels warm, inviting, and full of character. Morning light through a window above the sink. Farmhouse charm meets modern convenience."
-    },
-
-    # ---- STYLE GALLERY - CATEGORY IMAGES (11 additional styles) ----
-    {
-        "filename": "style-modern.jpg",
-        "prompt": f"{QUALITY_PREFIX} A pristine modern minimalist living room. {STYLE_PROMPTS['modern']}. Clean white walls, sleek low-profile furniture, single statement art piece. The room is a masterclass in restraint and elegance. Natural light floods the space. Ultra-clean lines and perfect proportions."
-    },
-    {
-        "filename": "style-scandinavian.jpg",
-        "prompt": f"{QUALITY_PREFIX} A perfect Scandinavian living room. {STYLE_PROMPTS['scandinavian']}. Light birch wood, white walls, hygge textiles. A cozy blanket draped over a simple sofa. Candlelight and natural light creating warmth. Minimalist but deeply comfortable."
-    },
-    {
-        "filename": "style-contemporary.jpg",
-        "prompt": f"{QUALITY_PREFIX} A sophisticated contemporary living room. {STYLE_PROMPTS['contemporary']}. Bold statement art on the wall, designer lighting, mix of textures. The room feels current, curated, and comfortable. Warm evening light with accent lighting."
-    },
-    {
-        "filename": "style-urban-loft.jpg",
-        "prompt": f"{QUALITY_PREFIX} A stunning urban loft apartment. {STYLE_PROMPTS['urban-loft']}. Soaring double-height ceilings, exposed brick, massive windows with city skyline views. Industrial meets refined luxury. The space feels like a New York or London creative's dream home. Dramatic golden hour light."
-    },
-    {
-        "filename": "style-victorian.jpg",
-        "prompt": f"{QUALITY_PREFIX} An elegant Victorian parlor room. {STYLE_PROMPTS['victorian']}. Rich dark wood, ornate fireplace, patterned wallpaper, crystal chandelier. The room transports you to a refined era of craftsmanship and elegance. Warm firelight and soft lamplight."
-    },
-    {
-        "filename": "style-french-country.jpg",
-        "prompt": f"{QUALITY_PREFIX} A charming French country kitchen. {STYLE_PROMPTS['french-country']}. Lavender accents, distressed white furniture, copper pots, stone floor. The room feels like a Provençal farmhouse in the south of France. Soft morning light through linen curtains."
-    },
-    {
-        "filename": "style-mediterranean.jpg",
-        "prompt": f"{QUALITY_PREFIX} A warm Mediterranean dining room. {STYLE_PROMPTS['mediterranean']}. Arched windows, terracotta tiles, wrought iron chandelier. The room feels like a villa overlooking the sea. Warm golden afternoon light flooding through arched doorways."
-    },
-    {
-        "filename": "style-industrial.jpg",
-        "prompt": f"{QUALITY_PREFIX} A bold industrial loft living space. {STYLE_PROMPTS['industrial']}. Exposed brick, steel beams, polished concrete. Factory windows flooding light. A leather Chesterfield sofa, reclaimed wood coffee table. The space feels raw, authentic, and incredibly cool."
-    },
-    {
-        "filename": "style-maximalist.jpg",
-        "prompt": f"{QUALITY_PREFIX} An exuberant maximalist living room. {STYLE_PROMPTS['maximalist']}. Bold patterned wallpaper, rich jewel-toned velvet furniture, eclectic art collection covering the walls. Every surface tells a story. The room is bursting with personality and curated chaos."
-    },
-    {
-        "filename": "style-tropical.jpg",
-        "prompt": f"{QUALITY_PREFIX} A luxurious tropical resort-style living room. {STYLE_PROMPTS['tropical']}. Rattan furniture, monstera plants, ceiling fan, open to a tropical garden. The room feels like a high-end Bali resort villa. Bright natural light with dappled shadows from palms."
-    },
-    {
-        "filename": "style-japandi.jpg",
-        "prompt": f"{QUALITY_PREFIX} A serene Japandi living room. {STYLE_PROMPTS['japandi']}. Low platform sofa, natural wood, paper shoji screen. A single bonsai tree as the focal point. The room breathes calm and intentionality. Soft diffused light creating a meditative atmosphere."
-    },
-
-    # ---- FEATURE IMAGES ----
-    {
-        "filename": "feature-speed.jpg",
-        "prompt": f"{QUALITY_PREFIX} A dramatic split-screen architectural visualization showing an empty room on the left transforming into a beautifully designed modern interior on the right. The left side is bare walls and empty floor. The right side is a stunning modern living room with designer furniture, art, and warm lighting. A glowing line of energy separates the two halves, representing AI transformation. Dynamic, impressive, technological."
-    },
-    {
-        "filename": "feature-chat.jpg",
-        "prompt": f"{QUALITY_PREFIX} A beautifully designed modern living room showing subtle design iterations - as if an AI assistant is refining the space. The room features {STYLE_PROMPTS['modern']}. Warm natural light, professional interior photography. The image conveys the idea of intelligent, iterative design refinement. Pristine and polished."
-    },
-    {
-        "filename": "feature-4k.jpg",
-        "prompt": f"{QUALITY_PREFIX} An extreme close-up detail shot of luxury interior design materials. Show the intricate grain of Italian marble countertop, the weave of linen fabric on a designer chair, the brushed brass of a modern light fixture, and the texture of hand-troweled plaster wall — all in stunning ultra-high-definition detail. Macro photography quality. Every fiber, vein, and surface imperfection visible. This demonstrates 4K resolution quality."
-    },
-    {
-        "filename": "feature-styles.jpg",
-        "prompt": f"{QUALITY_PREFIX} A creative grid composition showing 4 different interior design styles in one image — each quadrant showing the same room but in a completely different style: top-left Modern Minimalist (white, clean), top-right Industrial (brick, metal), bottom-left Bohemian (colorful, eclectic), bottom-right Japandi (zen, wood). Clean grid lines separate each quadrant. Professional architectural photography in each section."
-    },
-
-    # ---- STUDIO IMAGES ----
-    {
-        "filename": "studio-welcome.jpg",
-        "prompt": f"{QUALITY_PREFIX} A subtle, atmospheric background image for a design studio application. A softly blurred luxury interior space with warm ambient lighting, showing hints of modern architecture — exposed beams, floor-to-ceiling windows with golden hour light, designer furniture silhouettes. The image should be moody, dark, and atmospheric — suitable as a background that won't compete with UI elements on top of it. Cinematic depth of field with most of the image softly out of focus."
-    },
-]
-
-def generate_image(image_def, index, total):
-    """Generate a single image using the Gemini API."""
-    filename = image_def["filename"]
+_manifest_lock = threading.Lock()
+
+
+def cache_key(image_def, model=MODEL):
+    """Hash everything that determines an image: rendered prompt, model and config."""
+    material = json.dumps({
+        "prompt": render_prompt(image_def),
+        "model": model,
+        "generationConfig": GENERATION_CONFIG,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def load_manifest():
+    """Load the cache manifest, treating a missing or corrupt file as empty."""
+    try:
+        with open(CACHE_MANIFEST, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def _write_manifest(manifest):
+    tmp_path = CACHE_MANIFEST + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, CACHE_MANIFEST)
+
+
+def record_output(manifest, filename, key, size, sha256=None, dhash=None, model=MODEL):
+    """Record the hash that produced `filename` and persist the manifest."""
+    with _manifest_lock:
+        manifest[filename] = {"hash": key, "model": model, "size": size, "generatedAt": int(time.time())}
+        if sha256:
+            manifest[filename]["sha256"] = sha256
+        if dhash:
+            manifest[filename]["dhash"] = dhash
+        _write_manifest(manifest)
+
+
+def is_cached(manifest, filename, key):
+    """True if `filename` exists, was produced by exactly these inputs and is unchanged since."""
+    entry = manifest.get(filename)
+    if not entry or entry.get("hash") != key:
+        return False
     filepath = os.path.join(OUTPUT_DIR, filename)
+    if not os.path.exists(filepath):
+        return False
+    if "sha256" not in entry:
+        # Entries written before content hashes were recorded only know the file exists
+        return True
+    return os.path.getsize(filepath) == entry["size"] and file_sha256(filepath) == entry["sha256"]
 
-    # Skip if already exists and is > 100KB (real image, not placeholder)
-    if os.path.exists(filepath) and os.path.getsize(filepath) > 100000:
-        print(f"  [{index}/{total}] SKIP {filename} (already exists, {os.path.getsize(filepath)//1024}KB)")
-        return filename, True, "skipped"
 
-    print(f"  [{index}/{total}] Generating {filename}...")
+def adopt_existing(manifest, image_defs):
+    """Record current hashes for existing outputs that have no manifest entry yet."""
+    adopted = 0
+    for image_def in image_defs:
+        filename = image_def["filename"]
+        filepath = os.path.join(OUTPUT_DIR, filename)
+        if filename in manifest or not os.path.exists(filepath):
+            continue
+        manifest[filename] = {
+            "hash": cache_key(image_def),
+            "model": MODEL,
+            "size": os.path.getsize(filepath),
+            "generatedAt": int(os.path.getmtime(filepath)),
+        }
+        adopted += 1
+    if adopted:
+        with _manifest_lock:
+            _write_manifest(manifest)
+    return adopted
+
+
+# ============================================================
+# RUN JOURNAL - append-only record of per-image progress
+# ============================================================
+
+# Kept outside public/ so it is neither served nor deployed
+RUN_JOURNAL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           ".generation-journal.jsonl")
+
+# Journal states; anything other than "done" is unfinished work for --resume
+JOURNAL_STATES = ("queued", "in-flight", "done", "failed")
 
-    payload = json.dumps({
-        "contents": [{"parts": [{"text": image_def["prompt"]}]}],
-        "generationConfig": {"responseModalities": ["IMAGE", "TEXT"]}
-    }).encode("utf-8")
 
-    req = urllib.request.Request(
-        API_URL,
-        data=payload,
-        headers={"Content-Type": "application/json"},
-        method="POST"
-    )
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    for attempt in range(3):
+
+class RunJournal:
+    """JSONL journal of image state transitions, fsynced line by line.
+
+    Every record carries the run id, so the last run's unfinished images can
+    be recovered after a crash, Ctrl-C or network drop.
+    """
+
+    def __init__(self, path=RUN_JOURNAL, run_id=None):
+        self.path = path
+        self.run_id = run_id or f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self._lock = threading.Lock()
+        self._tail_checked = False
+
+    def _terminate_torn_line(self):
+        """Close off a last line torn by a crash, so our first record is not appended to it."""
         try:
-            start = time.time()
-            with urllib.request.urlopen(req, timeout=120) as resp:
-                data = json.loads(resp.read().decode("utf-8"))
-
-            elapsed = time.time() - start
-
-            if "candidates" in data:
-                for part in data["candidates"][0]["content"]["parts"]:
-                    if "inlineData" in part:
-                        img_data = base64.b64decode(part["inlineData"]["data"])
-                        # Save as PNG (the API returns PNG)
-                        png_path = filepath.replace('.jpg', '.png') if filepath.endswith('.jpg') else filepath
-                        # Actually save with the original filename
-                        with open(filepath, "wb") as f:
-                            f.write(img_data)
-                        size_kb = len(img_data) // 1024
-                        print(f"  [{index}/{total}] OK {filename} ({size_kb}KB, {elapsed:.1f}s)")
-                        return filename, True, f"{size_kb}KB"
-
-            error_msg = data.get("error", {}).get("message", "No image in response")
-            print(f"  [{index}/{total}] WARN {filename}: {error_msg}")
-            if attempt < 2:
-                time.sleep(2)
-                continue
-            return filename, False, error_msg
-
-        except urllib.error.HTTPError as e:
-            error_body = e.read().decode("utf-8") if e.fp else str(e)
-            print(f"  [{index}/{total}] HTTP {e.code} for {filename}: {error_body[:200]}")
-            if e.code == 429 and attempt < 2:
-                print(f"  [{index}/{total}] Rate limited, waiting 10s...")
-                time.sleep(10)
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+        except OSError:
+            return  # no journal yet, or an empty one
+        if torn:
+            with open(self.path, "ab") as f:
+                f.write(b"\n")
+
+    def record(self, filename, state, **fields):
+        assert state in JOURNAL_STATES, state
+        line = json.dumps({"run": self.run_id, "ts": round(time.time(), 3), "file": filename,
+                           "state": state, **fields}, sort_keys=True)
+        with self._lock:
+            if not self._tail_checked:
+                self._terminate_torn_line()
+                self._tail_checked = True
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def unfinished(path=RUN_JOURNAL):
+        """Return (run_id, filenames) for images the most recent run did not finish."""
+        latest = {}
+        run_id = None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a crash mid-write
+                    if record["run"] != run_id:
+                        run_id, latest = record["run"], {}
+                    latest[record["file"]] = record["state"]
+        except OSError:
+            return None, []
+        return run_id, [name for name, state in latest.items() if state != "done"]
+
+
+def remove_stale_partials(directory=OUTPUT_DIR):
+    """Delete temp files left behind by a run that died mid-write."""
+    removed = 0
+    for name in os.listdir(directory):
+        if (name.startswith(".") and name.endswith(".part")) or name.endswith(".tmp"):
+            os.unlink(os.path.join(directory, name))
+            removed += 1
+    return removed
+
+
+# ============================================================
+# INSTRUMENTATION - per-image timings and the run report
+# ============================================================
+
+# Like the journal, kept outside public/
+RUN_REPORT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".generation-metrics.json")
+
+
+@dataclasses.dataclass
+class ImageMetrics:
+    """Timings and counters for one image across all of its attempts.
+
+    `ttfb`, `latency` and `decode_seconds` describe the successful attempt;
+    `total_seconds` is wall time from first attempt to result, including backoff.
+    """
+    filename: str
+    status: str = "pending"
+    shard: str = ""
+    model: str = ""
+    attempts: int = 0
+    retries: int = 0
+    throttled: int = 0
+    server_errors: int = 0
+    ttfb: Optional[float] = None
+    latency: Optional[float] = None
+    decode_seconds: Optional[float] = None
+    total_seconds: Optional[float] = None
+    bytes_received: int = 0
+    output_bytes: int = 0
+    error: str = ""
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of `values` (pct in 0-100); None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize_metrics(metrics, wall_seconds):
+    """Aggregate per-image metrics into p50/p95/p99 latencies and throughput."""
+    generated = [m for m in metrics if m.status == "generated"]
+    summary = {
+        "images": len(metrics),
+        "generated": len(generated),
+        "skipped": sum(1 for m in metrics if m.status == "skipped"),
+        "copied": sum(1 for m in metrics if m.status == "copied"),
+        "failed": sum(1 for m in metrics if m.status == "failed"),
+        "attempts": sum(m.attempts for m in metrics),
+        "retries": sum(m.retries for m in metrics),
+        "throttled": sum(m.throttled for m in metrics),
+        "serverErrors": sum(m.server_errors for m in metrics),
+        "bytesReceived": sum(m.bytes_received for m in metrics),
+        "wallSeconds": round(wall_seconds, 3),
+        "imagesPerMinute": round(len(generated) / wall_seconds * 60, 2) if wall_seconds else None,
+        "megabytesPerSecond": round(sum(m.bytes_received for m in metrics) / wall_seconds / 1e6, 3)
+        if wall_seconds else None,
+    }
+    for field, name in (("ttfb", "ttfb"), ("latency", "latency"),
+                        ("decode_seconds", "decodeSeconds"), ("total_seconds", "totalSeconds")):
+        values = [getattr(m, field) for m in generated if getattr(m, field) is not None]
+        for pct in (50, 95, 99):
+            value = percentile(values, pct)
+            summary[f"{name}P{pct}"] = round(value, 3) if value is not None else None
+    return summary
+
+
+def write_run_report(path, metrics, summary, settings, shards=()):
+    """Write the run report: JSON (summary, shards, per-image rows) or CSV (per-image rows) by extension."""
+    rows = [dataclasses.asdict(m) for m in metrics]
+    tmp_path = path + ".tmp"
+    if path.endswith(".csv"):
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=[field.name for field in dataclasses.fields(ImageMetrics)])
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "summary": summary, "shards": list(shards), "images": rows}, f, indent=2)
+            f.write("\n")
+    os.replace(tmp_path, path)
+
+
+# ============================================================
+# ASYNC GENERATION ENGINE - adaptive concurrency + shared rate limit
+# ============================================================
+
+class APIError(Exception):
+    """Non-2xx response from the generateContent endpoint."""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class NoImageError(Exception):
+    """A 200 response that did not contain any inlineData part."""
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (delta-seconds or HTTP-date) into seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def backoff_delay(attempt, base=2.0, cap=60.0, retry_after=None):
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, base))
+    return delay
+
+
+class TokenBucket:
+    """Request rate limit for one shard, shared by every attempt sent through it."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def defer(self, seconds):
+        """Hold back all further requests for `seconds` (e.g. a server Retry-After)."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit: grows by ~1 per window of successes, halves on throttling."""
+
+    def __init__(self, initial, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self._last_decrease = 0.0
+
+    def try_acquire(self):
+        """Take a slot without waiting; returns False if the limit is reached."""
+        if self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self, started_at):
+        # Requests already in flight when we last backed off report the same
+        # overload; only the first of them should shrink the window.
+        if started_at < self._last_decrease:
+            return
+        self.limit = max(self.minimum, self.limit / 2)
+        self._last_decrease = time.monotonic()
+
+
+# ============================================================
+# STREAMING RESPONSE DECODING
+# ============================================================
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class Base64Sink:
+    """Decodes base64 text in 4-character-aligned chunks straight into a binary file."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.bytes_written = 0
+        self._pending = b""
+
+    def write(self, text):
+        data = self._pending + text
+        usable = len(data) - len(data) % 4
+        if usable:
+            decoded = binascii.a2b_base64(data[:usable])
+            self.fileobj.write(decoded)
+            self.bytes_written += len(decoded)
+        self._pending = data[usable:]
+
+    def close(self):
+        if self._pending:
+            # Accept a tail missing its "=" padding by padding it here; a lone
+            # leftover character is still invalid and raises binascii.Error
+            decoded = binascii.a2b_base64(self._pending + b"=" * (-len(self._pending) % 4))
+            self.fileobj.write(decoded)
+            self.bytes_written += len(decoded)
+            self._pending = b""
+
+
+class InlineDataExtractor:
+    """Incremental JSON scanner for generateContent responses.
+
+    The first `inlineData.data` string is streamed to `sink` as it arrives;
+    everything else is copied into `skeleton` with that value blanked out, so
+    the small remainder can still be parsed with json.loads for error and text
+    parts. Only the current key and the container stack are kept in memory.
+    """
+
+    _KEY_LIMIT = 64
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.skeleton = bytearray()
+        self.found = False
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._capturing = False
+        self._string = bytearray()
+        self._last_string = None
+        self._key = None
+        self._expect_value = False
+
+    def feed(self, chunk):
+        pos = 0
+        n = len(chunk)
+        while pos < n:
+            if self._capturing:
+                pos = self._feed_capture(chunk, pos)
                 continue
-            if e.code >= 500 and attempt < 2:
-                time.sleep(5)
+            byte = chunk[pos]
+            self.skeleton.append(byte)
+            pos += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif byte == 0x5C:  # backslash
+                    self._escape = True
+                    continue
+                elif byte == 0x22:  # closing quote
+                    self._in_string = False
+                    self._last_string = bytes(self._string)
+                    continue
+                if len(self._string) < self._KEY_LIMIT:
+                    self._string.append(byte)
+            elif byte == 0x22:
+                if (self._expect_value and not self.found and self._key == b"data"
+                        and self._stack and self._stack[-1] == b"inlineData"):
+                    self._capturing = True
+                    self.found = True
+                else:
+                    self._in_string = True
+                    self._string.clear()
+                self._expect_value = False
+            elif byte == 0x3A:  # ':' - the string just read was a key
+                self._key = self._last_string
+                self._expect_value = True
+            elif byte in (0x7B, 0x5B):  # '{' or '['
+                self._stack.append(self._key if self._expect_value else None)
+                self._expect_value = False
+            elif byte in (0x7D, 0x5D):  # '}' or ']'
+                if self._stack:
+                    self._stack.pop()
+            elif byte == 0x2C:  # ','
+                self._expect_value = False
+
+    def _feed_capture(self, chunk, pos):
+        if self._escape:
+            # Base64 only ever needs "\/"; other escapes (e.g. "\n" line breaks) are dropped
+            if chunk[pos] == 0x2F:
+                self.sink.write(b"/")
+            self._escape = False
+            return pos + 1
+        quote = chunk.find(b'"', pos)
+        backslash = chunk.find(b"\\", pos)
+        stop = min(i for i in (quote, backslash, len(chunk)) if i != -1)
+        if stop > pos:
+            self.sink.write(chunk[pos:stop])
+        if stop == len(chunk):
+            return stop
+        if stop == backslash:
+            self._escape = True
+            return stop + 1
+        # Closing quote of the data value: resume copying the skeleton
+        self._capturing = False
+        self.skeleton.append(0x22)
+        return stop + 1
+
+
+def stream_image_response(resp, filepath, stats=None):
+    """Stream a generateContent response body into `filepath` via a temp file.
+
+    Returns (bytes_written, skeleton) where skeleton is the parsed response with
+    the image data blanked out. The file is only renamed into place once the
+    whole image has been decoded. If `stats` is given, bytes received and the
+    time spent decoding/writing (excluding network reads) are added to it.
+    """
+    received = 0
+    decode_seconds = 0.0
+    directory = os.path.dirname(filepath) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(filepath)}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            sink = Base64Sink(f)
+            extractor = InlineDataExtractor(sink)
+            while True:
+                chunk = resp.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                started = time.perf_counter()
+                extractor.feed(chunk)
+                decode_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            sink.close()
+            decode_seconds += time.perf_counter() - started
+        skeleton = json.loads(extractor.skeleton.decode("utf-8"))
+        if extractor.found and sink.bytes_written:
+            os.replace(tmp_path, filepath)
+            return sink.bytes_written, skeleton
+        return 0, skeleton
+    finally:
+        if stats is not None:
+            stats["bytes_received"] = stats.get("bytes_received", 0) + received
+            stats["decode_seconds"] = stats.get("decode_seconds", 0.0) + decode_seconds
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+# ============================================================
+# HTTP CLIENT - keep-alive connection pool shared by all workers
+# ============================================================
+
+def default_transport(scheme, host, port, timeout):
+    """Open a new connection; swap this out to test against a stub server."""
+    if scheme == "https":
+        return http.client.HTTPSConnection(host, port, timeout=timeout)
+    return http.client.HTTPConnection(host, port, timeout=timeout)
+
+
+class ConnectionPool:
+    """Bounded LIFO pool of keep-alive connections to a single host."""
+
+    def __init__(self, scheme, host, port, size, timeout, transport):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.transport = transport
+        self.connections_opened = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        """Return (connection, reused), blocking while the pool is at capacity."""
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+            self.connections_opened += 1
+        try:
+            return self.transport(self.scheme, self.host, self.port, self.timeout), False
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, reusable):
+        if reusable:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class HTTPClient:
+    """Minimal pooled HTTP client: one bounded keep-alive pool per host."""
+
+    # Errors that mean an idle keep-alive connection was closed by the server
+    STALE_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, pool_size=8, timeout=120, transport=default_transport):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.transport = transport
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def pool_for(self, scheme, host, port):
+        key = (scheme, host, port)
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = ConnectionPool(scheme, host, port, self.pool_size, self.timeout, self.transport)
+            return self._pools[key]
+
+    @contextlib.contextmanager
+    def post(self, url, body, headers):
+        """POST `body` and yield the http.client response for streaming reads.
+
+        The connection goes back to the pool only if the body was fully read
+        and the server did not ask to close it, whether or not the caller raised.
+        """
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        pool = self.pool_for(parts.scheme, parts.hostname, port)
+        target = parts.path + (f"?{parts.query}" if parts.query else "")
+
+        while True:
+            conn, reused = pool.acquire()
+            try:
+                conn.request("POST", target, body=body, headers=headers)
+                resp = conn.getresponse()
+            except self.STALE_ERRORS:
+                pool.release(conn, False)
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                pool.release(conn, False)
+                raise
+            break
+
+        try:
+            yield resp
+        finally:
+            # Also reusable when the caller raised after reading the whole body (e.g. a 429)
+            pool.release(conn, resp.isclosed() and not resp.will_close)
+
+    def close(self):
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+
+def api_url(model=MODEL, key=None):
+    return f"{API_BASE}/v1beta/models/{model}:generateContent?key={key or API_KEY}"
+
+
+def request_image(client, prompt, filepath, stats=None, url=None):
+    """Make one generateContent call and stream the returned image to `filepath`.
+
+    Returns the number of bytes written. Raises APIError for HTTP errors and
+    NoImageError when the response has no image part. Timing and byte counts
+    for the attempt are recorded into `stats` when given.
+    """
+    stats = {} if stats is None else stats
+    payload = json.dumps({
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": GENERATION_CONFIG
+    }).encode("utf-8")
+
+    started = time.perf_counter()
+    with client.post(url or api_url(), payload, {"Content-Type": "application/json"}) as resp:
+        stats["ttfb"] = time.perf_counter() - started
+        if resp.status != 200:
+            error_body = resp.read()
+            stats["bytes_received"] = stats.get("bytes_received", 0) + len(error_body)
+            raise APIError(resp.status, error_body.decode("utf-8", "replace")[:200],
+                           parse_retry_after(resp.getheader("Retry-After")))
+        size, data = stream_image_response(resp, filepath, stats)
+
+    if size:
+        return size
+    raise NoImageError(data.get("error", {}).get("message", "No image in response"))
+
+
+# ============================================================
+# IMAGE OPTIMIZATION - real JPEG/WebP/AVIF + responsive variants
+# ============================================================
+
+# Widths emitted for responsive srcset use (only those narrower than the source)
+VARIANT_WIDTHS = (640, 1024, 1600)
+# Pillow format name -> (file extension, save options)
+IMAGE_FORMATS = {
+    "jpeg": ("jpg", {"quality": 82, "optimize": True, "progressive": True}),
+    "webp": ("webp", {"quality": 80, "method": 6}),
+    "avif": ("avif", {"quality": 60}),
+}
+# Kept outside public/ with the other run artifacts
+OPTIMIZATION_REPORT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".image-report.json")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def load_pillow():
+    """Import Pillow lazily; optimization is skipped when it is not installed."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def supported_formats(requested):
+    """Filter `requested` format names down to the ones this Pillow build can write."""
+    Image = load_pillow()
+    if Image is None:
+        return []
+    Image.init()
+    return [fmt for fmt in requested if fmt.upper() in Image.SAVE]
+
+
+def variant_name(filename, width, ext):
+    """e.g. ("after-modern.jpg", 640, "webp") -> "after-modern-640w.webp"; width=None is full size."""
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}-{width}w.{ext}" if width else f"{stem}.{ext}"
+
+
+def needs_optimization(entry, sha256, widths, formats, directory):
+    """True if the file is not the one the optimizer last wrote or its variants don't cover the request.
+
+    `sha256` is the file's current content hash; the report entry records the
+    hash of the primary file the optimizer produced.
+    """
+    if not entry or entry.get("sha256") != sha256:
+        return True
+    recorded = {(o["format"], o["width"]) for o in entry["outputs"]
+                if os.path.exists(os.path.join(directory, o["file"]))}
+    wanted = {(fmt, w) for fmt in formats for w in widths if w < entry["width"]}
+    wanted |= {(fmt, entry["width"]) for fmt in formats}
+    return not wanted <= recorded
+
+
+def _save_atomic(image, path, fmt, options):
+    tmp_path = path + ".tmp"
+    image.save(tmp_path, format=fmt.upper(), **options)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def optimize_image(filepath, widths, formats, transcoded=False):
+    """Transcode one generated image and write its responsive variants.
+
+    Runs in a worker process. The original filename is rewritten as a real
+    JPEG at full resolution; every format also gets `-{width}w` variants.
+    Metadata (EXIF, ICC, text chunks) is dropped. `transcoded` means the file
+    is already an output of this function (only variants are missing), so the
+    JPEG is not re-encoded. Returns a report entry.
+    """
+    Image = load_pillow()
+    directory, filename = os.path.split(filepath)
+    source_bytes = os.path.getsize(filepath)
+
+    with Image.open(filepath) as src:
+        source_format = src.format
+        # Copy pixels only, so no metadata from the source survives
+        image = src.convert("RGB")
+    image.info = {}
+    width, height = image.size
+
+    outputs = []
+    for fmt in formats:
+        ext, options = IMAGE_FORMATS[fmt]
+        # The JPEG full-size output keeps the original .jpg name the site links to
+        full_name = filename if fmt == "jpeg" else variant_name(filename, None, ext)
+        if fmt == "jpeg" and transcoded:
+            # Already stripped and encoded by us; re-encoding would only lose quality
+            size = source_bytes
+        else:
+            size = _save_atomic(image, os.path.join(directory, full_name), fmt, options)
+        outputs.append({"file": full_name, "format": fmt, "width": width, "bytes": size})
+
+        for target in widths:
+            if target >= width:
                 continue
-            return filename, False, f"HTTP {e.code}"
+            resized = image.resize((target, round(height * target / width)), Image.LANCZOS)
+            name = variant_name(filename, target, ext)
+            size = _save_atomic(resized, os.path.join(directory, name), fmt, options)
+            outputs.append({"file": name, "format": fmt, "width": target, "bytes": size})
+
+    return {
+        "filename": filename,
+        "sourceFormat": source_format,
+        "sourceBytes": source_bytes,
+        "width": width,
+        "height": height,
+        "outputs": outputs,
+        # The primary file stays raw API output unless "jpeg" was requested
+        "primaryFormat": "JPEG" if "jpeg" in formats else source_format,
+        "sha256": file_sha256(filepath),
+    }
+
+
+class ImageOptimizer:
+    """Process-pool stage that optimizes images as the engine finishes them."""
+
+    def __init__(self, widths=VARIANT_WIDTHS, formats=("jpeg", "webp", "avif"), workers=None):
+        self.widths = tuple(widths)
+        self.formats = supported_formats(formats)
+        self.workers = workers
+        self.report = {}
+        self._previous = self._load_report()
+        # Content hashes of every JPEG primary the optimizer has written
+        self._transcoded = {e["sha256"] for e in self._previous.values()
+                            if "sha256" in e and e.get("primaryFormat") == "JPEG"}
+        self._pool = None
+
+    @staticmethod
+    def _load_report():
+        try:
+            with open(OPTIMIZATION_REPORT, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __enter__(self):
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self
+
+    def __exit__(self, *exc):
+        self._pool.shutdown(wait=True)
+        return False
+
+    async def optimize(self, filename, index, total):
+        """Optimize `filename` if needed; returns True if files were rewritten."""
+        filepath = os.path.join(OUTPUT_DIR, filename)
+        loop = asyncio.get_running_loop()
+        sha256 = await loop.run_in_executor(self._pool, file_sha256, filepath)
+        previous = self.report.get(filename) or self._previous.get(filename)
+        if not needs_optimization(previous, sha256, self.widths, self.formats, OUTPUT_DIR):
+            return False
+        try:
+            entry = await loop.run_in_executor(self._pool, optimize_image, filepath, self.widths, self.formats,
+                                               sha256 in self._transcoded)
         except Exception as e:
-            print(f"  [{index}/{total}] ERROR {filename}: {e}")
-            if attempt < 2:
-                time.sleep(3)
-                continue
-            return filename, False, str(e)
+            print(f"  [{index}/{total}] OPTIMIZE FAILED {filename}: {e}")
+            return False
+        self.report[filename] = entry
+        if entry["primaryFormat"] == "JPEG":
+            self._transcoded.add(entry["sha256"])
+        jpeg = next(o["bytes"] for o in entry["outputs"] if o["file"] == filename) if "jpeg" in self.formats else None
+        detail = f" -> {jpeg//1024}KB jpeg" if jpeg else ""
+        print(f"  [{index}/{total}] OPTIMIZED {filename} ({entry['sourceBytes']//1024}KB {entry['sourceFormat']}"
+              f"{detail}, {len(entry['outputs'])} files)")
+        return True
+
+    def write_report(self):
+        """Merge this run's entries into the size report."""
+        if not self.report:
+            return None
+        report = self._load_report()
+        report.update(self.report)
+        tmp_path = OPTIMIZATION_REPORT + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        os.replace(tmp_path, OPTIMIZATION_REPORT)
+
+        source = sum(e["sourceBytes"] for e in self.report.values())
+        # Without a JPEG output the original file is served as the API returned it
+        served = sum(next((o["bytes"] for o in e["outputs"] if o["file"] == e["filename"]), e["sourceBytes"])
+                     for e in self.report.values())
+        return source, served
+
+
+# ============================================================
+# CANDIDATE SELECTION - generate N per image, keep the best
+# ============================================================
+
+# Losing candidates are archived here, outside public/, one folder per image
+CANDIDATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".image-candidates")
+# Grayscale std-dev below this is a blank frame or flat placeholder
+BLANK_STDDEV = 6.0
+# dHash Hamming distance at or below which two images count as the same picture
+DUPLICATE_DISTANCE = 6
+
+
+def dhash(image, size=8):
+    """64-bit difference hash of a Pillow image, as a hex string."""
+    gray = image.convert("L").resize((size + 1, size))
+    pixels = list(gray.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{size * size // 4}x}"
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def score_candidate(path, reference_hashes):
+    """Cheap local quality check for one candidate.
 
-    return filename, False, "Max retries exceeded"
+    Rewards resolution and tonal detail, rejects blank/placeholder frames and
+    penalizes near-duplicates of other catalog images (`reference_hashes` maps
+    filename -> dHash). Without Pillow, falls back to encoded size.
+    """
+    entry = {"path": path, "bytes": os.path.getsize(path)}
+    Image = load_pillow()
+    if Image is None:
+        entry["score"] = entry["bytes"] / 1e6
+        return entry
+    from PIL import ImageStat
 
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            gray = img.convert("L")
+        gray.thumbnail((256, 256))
+    except OSError as e:
+        entry["rejected"] = f"unreadable: {e}"
+        return entry
+
+    stddev = ImageStat.Stat(gray).stddev[0]
+    entry.update(width=width, height=height, stddev=round(stddev, 2), dhash=dhash(gray))
+    if stddev < BLANK_STDDEV:
+        entry["rejected"] = "blank or placeholder"
+        return entry
+
+    score = width * height / 1e6 + min(stddev, 80.0) / 80.0
+    for name, other in reference_hashes.items():
+        if hamming(entry["dhash"], other) <= DUPLICATE_DISTANCE:
+            entry["duplicateOf"] = name
+            score -= 1.0
+            break
+    entry["score"] = round(score, 4)
+    return entry
+
+
+def score_candidates(paths, reference_hashes):
+    """Score every candidate; returns entries sorted best-first, rejected ones last."""
+    entries = [score_candidate(path, reference_hashes) for path in paths]
+    return sorted(entries, key=lambda e: ("rejected" in e, -e.get("score", 0.0)))
+
+
+def promote_candidate(path, filepath):
+    """Move the winning candidate into place atomically, even across filesystems."""
+    try:
+        os.replace(path, filepath)
+    except OSError:
+        tmp_path = filepath + ".tmp"
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, filepath)
+        os.unlink(path)
+
+
+# ============================================================
+# SHARDED SCHEDULER - spread the batch over API keys x models
+# ============================================================
+
+# Statuses that mean a shard's key or model is unusable, rather than the prompt
+SHARD_FATAL_STATUSES = (401, 403, 404)
+
+
+class NoShardError(Exception):
+    """Every shard is disabled or out of quota."""
+
+
+class Shard:
+    """One API key + model pair with its own concurrency limit, rate limit and quota."""
+
+    def __init__(self, name, key, model, concurrency=3, max_concurrency=8, rate=1.0, burst=3, quota=None):
+        self.name = name
+        self.key = key
+        self.model = model
+        self.limiter = AdaptiveLimiter(concurrency, 1, max_concurrency)
+        self.bucket = TokenBucket(rate, burst)
+        self.quota = quota
+        self.cooldown_until = 0.0
+        self.disabled = None
+        # Slots handed out by ShardScheduler.acquire() whose request has not been sent yet
+        self.reserved = 0
+        self.stats = {"requests": 0, "ok": 0, "throttled": 0, "serverErrors": 0, "errors": 0}
+
+    @property
+    def url(self):
+        return api_url(self.model, self.key)
+
+    @property
+    def usable(self):
+        return not self.disabled and (self.quota is None or self.stats["requests"] + self.reserved < self.quota)
+
+    def record_request(self):
+        """Count the reserved request as sent."""
+        self.reserved -= 1
+        self.stats["requests"] += 1
+
+    def load(self):
+        return self.limiter.in_flight / self.limiter.limit
+
+    def cool_down(self, seconds):
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+
+    def summary(self):
+        return {"shard": self.name, "model": self.model, "limit": round(self.limiter.limit, 2),
+                "disabled": self.disabled, **self.stats}
+
+
+def build_shards(keys, models, concurrency=3, max_concurrency=8, rate=1.0, burst=3, quota=None):
+    """One shard per key x model; names never include the key itself."""
+    return [
+        Shard(f"key{i}:{model}", key, model, concurrency, max_concurrency, rate, burst, quota)
+        for i, key in enumerate(keys, 1)
+        for model in models
+    ]
+
+
+class ShardScheduler:
+    """Hands each attempt to the least-loaded shard that is usable and not cooling down."""
+
+    def __init__(self, shards):
+        self.shards = shards
+        self._cond = asyncio.Condition()
+
+    @property
+    def max_concurrency(self):
+        return sum(shard.limiter.maximum for shard in self.shards)
+
+    def _candidates(self, avoid, now):
+        usable = [shard for shard in self.shards if shard.usable]
+        if not usable:
+            if any(shard.reserved and not shard.disabled for shard in self.shards):
+                return [], []  # Quota is held by unsent reservations; one may be given back
+            raise NoShardError("No usable shard (all disabled or out of quota)")
+        # Prefer shards this item has not failed on, unless all of those are cooling down
+        fresh = [shard for shard in usable if shard not in avoid and now >= shard.cooldown_until]
+        return usable, fresh or [shard for shard in usable if now >= shard.cooldown_until]
+
+    def has_alternative(self, avoid):
+        """True if some usable shard outside `avoid` could take a retry right now."""
+        now = time.monotonic()
+        return any(shard.usable and shard not in avoid and now >= shard.cooldown_until for shard in self.shards)
+
+    async def acquire(self, avoid=()):
+        """Reserve a slot on the least-loaded eligible shard, waiting if all are busy."""
+        async with self._cond:
+            while True:
+                now = time.monotonic()
+                usable, eligible = self._candidates(avoid, now)
+                ready = [shard for shard in eligible if shard.limiter.in_flight < int(shard.limiter.limit)]
+                if ready:
+                    shard = min(ready, key=Shard.load)
+                    shard.limiter.try_acquire()
+                    shard.reserved += 1
+                    return shard
+                wake = min((shard.cooldown_until for shard in usable if shard.cooldown_until > now), default=None)
+                try:
+                    await asyncio.wait_for(self._cond.wait(), wake - now if wake else None)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, shard, sent=True):
+        """Free the slot; `sent=False` also hands back the quota reserved by acquire()."""
+        if not sent:
+            shard.reserved -= 1
+        shard.limiter.release()
+        async with self._cond:
+            self._cond.notify_all()
+
+
+class GenerationEngine:
+    """Runs a batch of image definitions on asyncio.
+
+    Work is spread over one or more shards (API key + model), each with its own
+    AIMD concurrency limit and token bucket. Without explicit `shards`, a single
+    shard is built from API_KEY, MODEL and the concurrency/rate arguments.
+    """
+
+    def __init__(self, manifest, concurrency=3, max_concurrency=8, rate=1.0, burst=3,
+                 max_attempts=5, force=False, client=None, optimizer=None, journal=None, backoff_base=2.0,
+                 candidates=1, shards=None):
+        self.manifest = manifest
+        self.optimizer = optimizer
+        self.journal = journal
+        self.metrics = {}
+        self.force = force
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.candidates = max(1, candidates)
+        self._dhashes = {}
+        # Selection reads the hashes of images picked so far, so picks happen one at a time
+        self._selection_lock = asyncio.Lock()
+        # Timings of each output path's successful attempt, until copied onto the image's metrics
+        self._attempt_results = {}
+        self.scheduler = ShardScheduler(
+            shards or build_shards([API_KEY], [MODEL], concurrency, max_concurrency, rate, burst))
+        self.models = sorted({shard.model for shard in self.scheduler.shards})
+        workers = self.scheduler.max_concurrency
+        self.client = client or HTTPClient(pool_size=workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def generate_image(self, image_def, index, total):
+        """Generate a single image, retrying transient failures. Returns (filename, success, info)."""
+        filename = image_def["filename"]
+        filepath = os.path.join(OUTPUT_DIR, filename)
+        metrics = self.metrics[filename] = ImageMetrics(filename)
+
+        # Skip if the existing file was generated from the same prompt/config by any model in use
+        if not self.force and any(is_cached(self.manifest, filename, cache_key(image_def, model))
+                                  for model in self.models):
+            print(f"  [{index}/{total}] SKIP {filename} (up to date, {os.path.getsize(filepath)//1024}KB)")
+            metrics.status = "skipped"
+            return filename, True, "skipped"
+
+        first_started = time.monotonic()
+        if self.candidates > 1:
+            result = await self._generate_candidates(image_def, index, total, filepath, metrics)
+        else:
+            result = await self._attempt_loop(image_def, index, total, filepath, metrics)
+            if result[1]:
+                self._apply_attempt(metrics, self._attempt_results.pop(filepath))
+        metrics.total_seconds = time.monotonic() - first_started
+        metrics.retries = max(0, metrics.attempts - self.candidates)
+        metrics.status = "generated" if result[1] else "failed"
+        if result[1]:
+            record_output(self.manifest, filename, cache_key(image_def, metrics.model), metrics.output_bytes,
+                          model=metrics.model)
+        else:
+            metrics.error = result[2]
+        return result
+
+    @staticmethod
+    def _apply_attempt(metrics, attempt):
+        """Copy one successful attempt's shard, model and timings onto the image's metrics."""
+        for field, value in attempt.items():
+            setattr(metrics, field, value)
+
+    async def _generate_candidates(self, image_def, index, total, filepath, metrics):
+        """Fan out `candidates` requests for one image, score them and keep the best."""
+        filename = image_def["filename"]
+        archive_dir = os.path.join(CANDIDATE_DIR, os.path.splitext(filename)[0])
+        os.makedirs(archive_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        paths = [os.path.join(archive_dir, f"{stamp}-{k}.png") for k in range(1, self.candidates + 1)]
+
+        results = await asyncio.gather(*(
+            self._attempt_loop(image_def, index, total, path, metrics, label=f"{filename}#{k}")
+            for k, path in enumerate(paths, 1)
+        ))
+        generated = [path for path, (_, success, _) in zip(paths, results) if success]
+        attempts = {path: self._attempt_results.pop(path) for path in generated}
+        if not generated:
+            return filename, False, results[0][2]
+
+        async with self._selection_lock:
+            references = {name: entry["dhash"] for name, entry in self.manifest.items() if "dhash" in entry}
+            references.update(self._dhashes)
+            references.pop(filename, None)
+            loop = asyncio.get_running_loop()
+            ranked = await loop.run_in_executor(self._executor, score_candidates, generated, references)
+            with open(os.path.join(archive_dir, f"{stamp}-scores.json"), "w", encoding="utf-8") as f:
+                json.dump(ranked, f, indent=2)
+                f.write("\n")
+
+            best = ranked[0]
+            if "rejected" in best:
+                return filename, False, f"All {len(generated)} candidates rejected ({best['rejected']})"
+            promote_candidate(best["path"], filepath)
+            # Report the kept candidate's timings, not whichever finished last
+            self._apply_attempt(metrics, attempts[best["path"]])
+            if "dhash" in best:
+                self._dhashes[filename] = best["dhash"]
+        metrics.output_bytes = os.path.getsize(filepath)
+        rejected = sum(1 for e in ranked if "rejected" in e)
+        size_kb = metrics.output_bytes // 1024
+        print(f"  [{index}/{total}] PICKED {filename} <- {os.path.basename(best['path'])} "
+              f"(score {best['score']}, {len(generated)} candidates, {rejected} rejected)")
+        return filename, True, f"{size_kb}KB, best of {len(generated)}"
+
+    async def _attempt_loop(self, image_def, index, total, filepath, metrics, label=None):
+        """Retry loop behind generate_image(); fills in `metrics` as attempts complete."""
+        filename = image_def["filename"]
+        label = label or filename
+        loop = asyncio.get_running_loop()
+        error = "Max retries exceeded"
+        avoid = set()
+        for attempt in range(self.max_attempts):
+            retry_after = None
+            throttled = False
+            sent = False
+            stats = {}
+            try:
+                shard = await self.scheduler.acquire(avoid)
+            except NoShardError as e:
+                return filename, False, error if attempt else str(e)
+            try:
+                await shard.bucket.acquire()
+                started_at = time.monotonic()
+                shard.record_request()
+                sent = True
+                if self.journal:
+                    self.journal.record(filename, "in-flight", attempt=attempt + 1, shard=shard.name)
+                print(f"  [{index}/{total}] Generating {label}... (attempt {attempt + 1}, {shard.name}, "
+                      f"{shard.limiter.in_flight}/{int(shard.limiter.limit)} in flight)")
+                metrics.attempts += 1
+                metrics.shard = shard.name
+                size = await loop.run_in_executor(
+                    self._executor, request_image, self.client, render_prompt(image_def), filepath, stats,
+                    shard.url)
+                elapsed = time.monotonic() - started_at
+                self._attempt_results[filepath] = {
+                    "shard": shard.name, "model": shard.model, "ttfb": stats.get("ttfb"), "latency": elapsed,
+                    "decode_seconds": stats.get("decode_seconds"), "output_bytes": size,
+                }
+                shard.limiter.on_success()
+                shard.stats["ok"] += 1
+                size_kb = size // 1024
+                print(f"  [{index}/{total}] OK {label} ({size_kb}KB, {elapsed:.1f}s)")
+                return filename, True, f"{size_kb}KB"
+            except APIError as e:
+                print(f"  [{index}/{total}] HTTP {e.status} for {label} on {shard.name}: {e.message}")
+                error = f"HTTP {e.status}"
+                if e.status in SHARD_FATAL_STATUSES:
+                    # A bad key or unknown model: take the shard out and try another one
+                    shard.stats["errors"] += 1
+                    if not shard.disabled:
+                        shard.disabled = error
+                        print(f"  Disabling shard {shard.name} ({error})")
+                    continue
+                if e.status == 429:
+                    metrics.throttled += 1
+                    shard.stats["throttled"] += 1
+                elif e.status >= 500:
+                    metrics.server_errors += 1
+                    shard.stats["serverErrors"] += 1
+                else:
+                    return filename, False, error
+                throttled = True
+                shard.limiter.on_throttle(started_at)
+                retry_after = e.retry_after
+                if retry_after:
+                    shard.bucket.defer(retry_after)
+            except NoImageError as e:
+                print(f"  [{index}/{total}] WARN {label}: {e}")
+                error = str(e)
+                shard.stats["errors"] += 1
+            except Exception as e:
+                print(f"  [{index}/{total}] ERROR {label}: {e}")
+                error = str(e)
+                shard.stats["errors"] += 1
+            finally:
+                metrics.bytes_received += stats.get("bytes_received", 0)
+                await self.scheduler.release(shard, sent)
+
+            avoid.add(shard)
+            if attempt < self.max_attempts - 1:
+                delay = backoff_delay(attempt, base=self.backoff_base, retry_after=retry_after)
+                if throttled:
+                    shard.cool_down(delay)
+                if self.scheduler.has_alternative(avoid):
+                    print(f"  [{index}/{total}] Retrying {label} on another shard...")
+                    continue
+                print(f"  [{index}/{total}] Retrying {label} in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+
+        return filename, False, error
+
+    async def _process(self, image_def, index, total):
+        result = await self.generate_image(image_def, index, total)
+        filename, success, info = result
+        optimized = False
+        if success and self.optimizer:
+            optimized = await self.optimizer.optimize(filename, index, total)
+        # A cached image the optimizer rewrote needs its new size and hash recorded too
+        if success and (info != "skipped" or optimized):
+            await self._finalize(image_def)
+        if self.journal:
+            if success:
+                entry = self.manifest.get(filename, {})
+                self.journal.record(filename, "done", sha256=entry.get("sha256"), size=entry.get("size"),
+                                    cached=info == "skipped")
+            else:
+                self.journal.record(filename, "failed", reason=info)
+        return result
+
+    async def _finalize(self, image_def):
+        """Record the final (post-optimization) size and content hash in the manifest."""
+        filename = image_def["filename"]
+        filepath = os.path.join(OUTPUT_DIR, filename)
+        loop = asyncio.get_running_loop()
+        sha256 = await loop.run_in_executor(self._executor, file_sha256, filepath)
+        size = os.path.getsize(filepath)
+        self.metrics[filename].output_bytes = size
+        entry = self.manifest[filename]
+        record_output(self.manifest, filename, entry["hash"], size, sha256,
+                      self._dhashes.get(filename, entry.get("dhash")), model=entry["model"])
+
+    async def _process_group(self, image_def, followers, index, total):
+        """Generate one unique prompt, then fan its output out to identical definitions."""
+        result = await self._process(image_def, index, total)
+        results = [result]
+        for follower in followers:
+            results.append(await self._fan_out(image_def, result, follower, index, total))
+        return results
+
+    async def _fan_out(self, leader_def, leader_result, image_def, index, total):
+        leader, filename = leader_def["filename"], image_def["filename"]
+        metrics = self.metrics[filename] = ImageMetrics(filename)
+        if not leader_result[1]:
+            metrics.status = "failed"
+            metrics.error = f"duplicate of {leader}, which failed"
+            result = (filename, False, metrics.error)
+        else:
+            entry = self.manifest[leader]
+            if not self.force and is_cached(self.manifest, filename, entry["hash"]):
+                metrics.status = "skipped"
+                if self.optimizer and await self.optimizer.optimize(filename, index, total):
+                    await self._finalize(image_def)
+                result = (filename, True, "skipped")
+            else:
+                filepath = os.path.join(OUTPUT_DIR, filename)
+                tmp_path = filepath + ".tmp"
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self._executor, shutil.copyfile, os.path.join(OUTPUT_DIR, leader), tmp_path)
+                os.replace(tmp_path, filepath)
+                if self.optimizer:
+                    await self.optimizer.optimize(filename, index, total)
+                sha256 = await loop.run_in_executor(self._executor, file_sha256, filepath)
+                metrics.status = "copied"
+                metrics.model = entry["model"]
+                metrics.output_bytes = os.path.getsize(filepath)
+                record_output(self.manifest, filename, entry["hash"], metrics.output_bytes, sha256,
+                              entry.get("dhash"), model=entry["model"])
+                print(f"  [{index}/{total}] COPY {filename} <- {leader} (identical prompt)")
+                result = (filename, True, f"copy of {leader}")
+        if self.journal:
+            if result[1]:
+                self.journal.record(filename, "done", sha256=self.manifest[filename].get("sha256"),
+                                    size=self.manifest[filename].get("size"), cached=result[2] == "skipped")
+            else:
+                self.journal.record(filename, "failed", reason=result[2])
+        return result
+
+    async def run(self, image_defs):
+        """Generate `image_defs` in priority order, calling the API once per distinct prompt."""
+        total = len(image_defs)
+        leaders, followers = group_duplicates(prioritize(image_defs))
+        if self.journal:
+            for image_def in image_defs:
+                self.journal.record(image_def["filename"], "queued")
+        try:
+            groups = await asyncio.gather(*(
+                self._process_group(img_def, followers.get(img_def["filename"], ()), i, total)
+                for i, img_def in enumerate(leaders, 1)
+            ))
+            return [result for group in groups for result in group]
+        finally:
+            self._executor.shutdown(wait=True)
+            self.client.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate landing page and studio images with the Gemini API.")
+    parser.add_argument("patterns", nargs="*",
+                        help="only images whose filename matches one of these globs (e.g. 'style-*')")
+    parser.add_argument("--tag", action="append", default=[],
+                        help="only images with this tag or group id (repeatable, e.g. --tag studio)")
+    parser.add_argument("--catalog", default=CATALOG_PATH,
+                        help="image catalog JSON (default: scripts/landing-images.json)")
+    parser.add_argument("--matrix", action="store_true",
+                        help="also include every style x room cell from the catalog's matrices")
+    parser.add_argument("--list", action="store_true",
+                        help="list the selected images and exit")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="show which selected images would be generated or skipped, without calling the API")
+    parser.add_argument("--report", default=RUN_REPORT,
+                        help="run report path; .csv for per-image rows, otherwise JSON (default: %(default)s)")
+    parser.add_argument("--resume", action="store_true",
+                        help="only retry the images the last run left queued, in flight or failed")
+    parser.add_argument("--force", action="store_true",
+                        help="regenerate every image, ignoring the cache manifest")
+    parser.add_argument("--adopt-existing", action="store_true",
+                        help="record current prompt hashes for existing images without regenerating them")
+    parser.add_argument("--model", action="append", dest="models",
+                        help=f"model to shard across (repeatable; default: {MODEL})")
+    parser.add_argument("--concurrency", type=int, default=3,
+                        help="initial number of requests in flight per shard (default: 3)")
+    parser.add_argument("--max-concurrency", type=int, default=8,
+                        help="upper bound for each shard's adaptive concurrency limit (default: 8)")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="request rate limit per shard in requests/second (default: 1.0)")
+    parser.add_argument("--burst", type=int, default=3,
+                        help="token bucket burst size per shard (default: 3)")
+    parser.add_argument("--shard-quota", type=int, default=None,
+                        help="stop sending requests to a shard after this many in one run")
+    parser.add_argument("--max-attempts", type=int, default=5,
+                        help="attempts per image before giving up (default: 5)")
+    parser.add_argument("--candidates", type=int, default=1,
+                        help="generate N candidates per image in parallel and keep the best-scoring one "
+                             "(others are archived in .image-candidates/)")
+    parser.add_argument("--no-optimize", action="store_true",
+                        help="keep the raw API output instead of transcoding it")
+    parser.add_argument("--formats", default="jpeg,webp,avif",
+                        help="comma-separated output formats (default: jpeg,webp,avif)")
+    parser.add_argument("--widths", default=",".join(str(w) for w in VARIANT_WIDTHS),
+                        help="comma-separated responsive variant widths (default: %(default)s)")
+    parser.add_argument("--optimize-workers", type=int, default=None,
+                        help="processes used for encoding (default: CPU count)")
+    return parser.parse_args(argv)
+
+
+def list_images(images):
+    for image_def in images:
+        subject = ", ".join(filter(None, (image_def.get("style"), image_def.get("room"))))
+        print(f"  {image_def['filename']:<32} {image_def['group']:<16} {subject}".rstrip())
+    print(f"\n  {len(images)} image(s)")
+
+
+def dry_run(images, manifest, force, models):
+    leaders, followers = group_duplicates(prioritize(images))
+    pending = 0
+    for image_def in leaders:
+        cached = not force and any(is_cached(manifest, image_def["filename"], cache_key(image_def, model))
+                                   for model in models)
+        pending += not cached
+        state = "skip" if cached else "generate"
+        print(f"  {state:<9} {image_def['filename']:<32} (priority {image_def.get('priority', 0)}, "
+              f"{len(render_prompt(image_def))} chars)")
+        for follower in followers.get(image_def["filename"], ()):
+            print(f"  {'copy':<9} {follower['filename']:<32} (identical prompt to {image_def['filename']})")
+    copies = len(images) - len(leaders)
+    print(f"\n  {pending} of {len(images)} image(s) would be generated"
+          + (f", {copies} duplicate prompt(s) copied instead of regenerated" if copies else ""))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # The interrupted run may have used --matrix, so resuming always sees every matrix cell
+    images = load_images(args.catalog, include_matrices=args.matrix or args.resume)
+    errors = validate_images(images)
+    if errors:
+        print("ERROR: Invalid image catalog:")
+        for error in errors:
+            print(f"  - {error}")
+        return 1
+    if args.resume:
+        run_id, unfinished = RunJournal.unfinished()
+        if not unfinished:
+            print("Nothing to resume" + (f" (run {run_id} finished)" if run_id else " (no run journal)"))
+            return 0
+        print(f"  Resuming run {run_id}: {len(unfinished)} unfinished image(s)")
+        images = [image_def for image_def in images if image_def["filename"] in set(unfinished)]
+        missing = set(unfinished) - {image_def["filename"] for image_def in images}
+        if missing:
+            print(f"  WARN: {len(missing)} unfinished image(s) no longer in the catalog: {', '.join(sorted(missing))}")
+    else:
+        images = select_images(images, args.patterns, args.tag)
+    if not images:
+        print("No images match the given filters")
+        return 1
+
+    if args.list:
+        list_images(images)
+        return 0
+
+    models = args.models or [MODEL]
+    manifest = load_manifest()
+    if args.dry_run:
+        dry_run(images, manifest, args.force, models)
+        return 0
+
+    keys = API_KEYS or ([API_KEY] if API_KEY else [])
+    if not keys:
+        print("ERROR: Set GEMINI_API_KEY (or GEMINI_API_KEYS) environment variable")
+        return 1
 
-def main():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
+    stale = remove_stale_partials()
+    if stale:
+        print(f"  Removed {stale} partial file(s) left by an interrupted run")
+    if args.adopt_existing:
+        adopted = adopt_existing(manifest, images)
+        print(f"  Adopted {adopted} existing image(s) into {os.path.basename(CACHE_MANIFEST)}")
 
-    total = len(IMAGES)
+    total = len(images)
     print(f"\n{'='*60}")
     print(f"  Nano Banana Pro Image Generator")
-    print(f"  Model: {MODEL}")
+    print(f"  Model{'s' if len(models) > 1 else ''}: {', '.join(models)}")
+    if len(keys) * len(models) > 1:
+        print(f"  Shards: {len(keys) * len(models)} ({len(keys)} key(s) x {len(models)} model(s))")
     print(f"  Images to generate: {total}")
+    print(f"  Concurrency: {args.concurrency} (max {args.max_concurrency}), rate {args.rate}/s per shard")
+    if args.candidates > 1:
+        print(f"  Candidates per image: {args.candidates}")
     print(f"  Output: {OUTPUT_DIR}")
     print(f"{'='*60}\n")
 
-    # Use ThreadPoolExecutor for concurrent generation
-    max_workers = 3  # 3 concurrent requests
-    results = []
+    optimizer = None
+    if not args.no_optimize:
+        optimizer = ImageOptimizer(
+            widths=[int(w) for w in args.widths.split(",") if w],
+            formats=[f.strip().lower() for f in args.formats.split(",") if f.strip()],
+            workers=args.optimize_workers,
+        )
+        if not optimizer.formats:
+            print("  WARN: Pillow is not installed (or supports none of --formats); skipping optimization\n")
+            optimizer = None
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {}
-        for i, img_def in enumerate(IMAGES, 1):
-            future = executor.submit(generate_image, img_def, i, total)
-            futures[future] = img_def["filename"]
+    async def run():
+        engine = GenerationEngine(
+            manifest,
+            concurrency=args.concurrency,
+            max_concurrency=args.max_concurrency,
+            rate=args.rate,
+            burst=args.burst,
+            max_attempts=args.max_attempts,
+            force=args.force,
+            optimizer=optimizer,
+            journal=RunJournal(),
+            candidates=args.candidates,
+            shards=build_shards(keys, models, args.concurrency, args.max_concurrency, args.rate, args.burst,
+                                args.shard_quota),
+        )
+        return engine, await engine.run(images)
 
-        for future in as_completed(futures):
-            filename, success, info = future.result()
-            results.append((filename, success, info))
+    run_started = time.monotonic()
+    if optimizer:
+        with optimizer:
+            engine, results = asyncio.run(run())
+        sizes = optimizer.write_report()
+        if sizes:
+            print(f"\n  Optimized {len(optimizer.report)} image(s): {sizes[0]//1024}KB -> {sizes[1]//1024}KB "
+                  f"(report: {os.path.basename(OPTIMIZATION_REPORT)})")
+    else:
+        engine, results = asyncio.run(run())
+    wall_seconds = time.monotonic() - run_started
 
     # Summary
-    succeeded = sum(1 for _, s, _ in results if s)
+    succeeded = sum(1 for _, s, info in results if s and info != "skipped")
     failed = sum(1 for _, s, info in results if not s)
     skipped = sum(1 for _, s, info in results if s and info == "skipped")
 
+    metrics = [engine.metrics[filename] for filename, _, _ in results]
+    summary = summarize_metrics(metrics, wall_seconds)
+    shards = [shard.summary() for shard in engine.scheduler.shards]
+    write_run_report(args.report, metrics, summary, {
+        "concurrency": args.concurrency,
+        "maxConcurrency": args.max_concurrency,
+        "rate": args.rate,
+        "burst": args.burst,
+        "maxAttempts": args.max_attempts,
+        "shardQuota": args.shard_quota,
+    }, shards)
+
     print(f"\n{'='*60}")
     print(f"  RESULTS: {succeeded} OK, {failed} FAILED, {skipped} SKIPPED")
+    if summary["generated"]:
+        print(f"  Latency p50/p95/p99: {summary['latencyP50']}s / {summary['latencyP95']}s / "
+              f"{summary['latencyP99']}s (TTFB p50 {summary['ttfbP50']}s)")
+        print(f"  Throughput: {summary['imagesPerMinute']} images/min, {summary['attempts']} attempts, "
+              f"{summary['throttled']} throttled, {summary['serverErrors']} server errors")
+    if len(shards) > 1:
+        for shard in shards:
+            state = f", disabled ({shard['disabled']})" if shard["disabled"] else ""
+            print(f"    {shard['shard']}: {shard['ok']}/{shard['requests']} OK, "
+                  f"{shard['throttled']} throttled, limit {shard['limit']}{state}")
+    print(f"  Report: {args.report}")
     print(f"{'='*60}")
 
     if failed: